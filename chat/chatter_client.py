@@ -1,13 +1,16 @@
 import asyncio
 
 import aiohttp
+import uvloop
 
 
 async def main():
+    loop = asyncio.get_running_loop()
     async with aiohttp.ClientSession() as session:
         async with session.ws_connect('http://127.0.0.1:8080') as ws:
             while True:
-                msg = input('Please enter something: ')
+                # read stdin in a thread, keep the loop free for ping/pong frames
+                msg = await loop.run_in_executor(None, input, 'Please enter something: ')
                 if not msg:
                     break
                 await ws.send_str(msg)
@@ -16,5 +19,4 @@ async def main():
 
 
 if __name__ == '__main__':
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    uvloop.run(main())
@@ -1,37 +1,61 @@
-import asyncio
 import time
+import zlib
 from functools import partial
-import json
 
 import aiohttp
+import msgpack
+import uvloop
+
+
+# Date prompt of the last logged second,
+# only formatted again when the second changes
+_last_second = 0
+_date_prompt = ''
 
 
 def log(prompt: str, text: str):
-    date_prompt = f"({time.strftime('%H:%M:%S')})"
-    print(date_prompt, f'{prompt} {text}')
+    global _last_second, _date_prompt
+    now = int(time.time())
+    if now != _last_second:
+        _last_second = now
+        _date_prompt = time.strftime('(%H:%M:%S)', time.localtime(now))
+    print(_date_prompt, prompt, text)
+
 
+def inflate(data: bytes):
+    """Yield the payload of each zlib stream concatenated in `data`"""
+    while data:
+        decompressor = zlib.decompressobj()
+        yield decompressor.decompress(data)
+        data = decompressor.unused_data
+
+
+# Handlers of the events carry only a name, any other action is a sent text
 ACTION = {
     'connect': partial(log, 'Connected as'),
     'disconnect': partial(log, 'Disconnected'),
     'join': partial(log, 'Joined'),
-    'sent': log
 }
 
+
 async def main():
     async with aiohttp.ClientSession() as session:
         async with session.ws_connect('http://127.0.0.1:8080') as ws:
+            unpacker = msgpack.Unpacker(raw=False)
             async for msg in ws:
-                if msg.type == aiohttp.WSMsgType.TEXT:
-                    data = json.loads(msg.data)
-                    action = data['action']
-                    if action == 'sent':
-                        log(data['name'] + ': ', data['text'])
-                    else:
-                        ACTION[action](data['name'])
+                if msg.type == aiohttp.WSMsgType.BINARY:
+                    # server may merge several frames into one message
+                    for frame in inflate(msg.data):
+                        unpacker.feed(frame)
+                    for data in unpacker:
+                        handler = ACTION.get(data['action'])
+                        if handler is not None:
+                            handler(data['name'])
+                        else:
+                            log(data['name'] + ': ', data['text'])
                 elif msg.type == aiohttp.WSMsgType.ERROR:
                     break
 
 
 if __name__ == '__main__':
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(main())
+    uvloop.run(main())
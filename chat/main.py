@@ -1,5 +1,7 @@
+import asyncio
 import logging
 
+import uvloop
 from aiohttp import web, WSCloseCode
 
 from views import index
@@ -9,6 +11,10 @@ async def init_app():
     app = web.Application()
 
     app['websockets'] = {}
+    # outbound frame queue of each websocket, drained by its sender task
+    app['queues'] = {}
+    # bumped on every join/leave so connections know when to rebuild their peer snapshot
+    app['ws_version'] = 0
 
     app.on_shutdown.append(shutdown)
 
@@ -18,16 +24,21 @@ async def init_app():
 
 
 async def shutdown(app):
-    for ws in app['websockets'].values():
-        await ws.close(code=WSCloseCode.GOING_AWAY, message='Server shutdown')
+    # a slow client must not delay closing the others
+    await asyncio.gather(
+        *[ws.close(code=WSCloseCode.GOING_AWAY, message='Server shutdown') for ws in app['websockets'].values()],
+        return_exceptions=True
+    )
     app['websockets'].clear()
+    app['queues'].clear()
 
 
 def main():
     logging.basicConfig(level=logging.DEBUG)
 
     app = init_app()
-    web.run_app(app)   
+    # no global policy, `uvloop.install` is deprecated
+    web.run_app(app, loop=uvloop.new_event_loop())
 
 
 if __name__ == '__main__':
@@ -1,6 +1,12 @@
+import asyncio
+import itertools
 import logging
+import random
+import weakref
+import zlib
 
 import aiohttp
+import msgpack
 from aiohttp import web
 from faker import Faker
 
@@ -9,34 +15,107 @@ log = logging.getLogger(__name__)
 
 fake = Faker()
 
+# Generated once at startup, so connecting costs no Faker work
+NAMES = [fake.name() for _ in range(10_000)]
+
+# suffix of each name, keeps names (the keys of app['websockets']) unique
+_counter = itertools.count()
+
+# Reused by every broadcast, packing is synchronous so sharing it within the event loop is safe
+PACKER = msgpack.Packer(use_bin_type=True)
+
+# Fastest zlib level, broadcast frames are small and latency sensitive
+COMPRESS_LEVEL = 1
+
+# Max pending frames per client before new ones are dropped
+QUEUE_SIZE = 1000
+
+# Max frames merged into a single websocket write
+MAX_BATCH = 32
+
+# Queues already warned about being full, forgotten with their clients
+_full_queues: "weakref.WeakSet[asyncio.Queue]" = weakref.WeakSet()
+
+
+async def drain(ws, queue: asyncio.Queue):
+    """Long-lived sender task of a client, merges pending frames into one websocket write.
+
+    Each frame is a complete zlib stream, the client inflates them one after another.
+    """
+    while True:
+        batch = [await queue.get()]
+        while not queue.empty() and len(batch) < MAX_BATCH:
+            batch.append(queue.get_nowait())
+        await ws.send_bytes(b''.join(batch))
+
+
+def pack(payload: dict) -> bytes:
+    """Pack `payload` into a compressed MessagePack frame."""
+    return zlib.compress(PACKER.pack(payload), COMPRESS_LEVEL)
+
+
+def broadcast(queues, payload: dict):
+    """Pack and compress `payload` once and enqueue it for all `queues`.
+
+    A slow client only drops its own frames, it never stalls the sender.
+    """
+    data = pack(payload)
+    for queue in queues:
+        try:
+            queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # once per client, a stuck one would otherwise log every message from now on
+            if queue not in _full_queues:
+                _full_queues.add(queue)
+                log.warning('Outbound queue of a client is full, dropping its messages')
+
+
 async def index(request):
-    ws_current = web.WebSocketResponse()
+    # frames are compressed here once per broadcast, not per recipient by permessage-deflate
+    ws_current = web.WebSocketResponse(compress=False)
     ws_ready = ws_current.can_prepare(request)
     if not ws_ready.ok:
         return web.json_response({'error': 'Sorry, can not establish a websocket connection.'})
     await ws_current.prepare(request)
 
-    name = fake.name()
+    name = f'{random.choice(NAMES)}#{next(_counter)}'
     log.info(f'{name} joined.')
 
-    await ws_current.send_json({'action': 'connect', 'name': name})
+    await ws_current.send_bytes(pack({'action': 'connect', 'name': name}))
+
+    out_q = asyncio.Queue(maxsize=QUEUE_SIZE)
+    sender = asyncio.create_task(drain(ws_current, out_q))
 
-    for ws in request.app['websockets'].values():
-        await ws.send_json({'action': 'join', 'name': name})
+    broadcast(request.app['queues'].values(), {'action': 'join', 'name': name})
     request.app['websockets'][name] = ws_current
+    request.app['queues'][name] = out_q
+    request.app['ws_version'] += 1
+
+    peers_version = -1
+    peers = ()
+    try:
+        async for msg in ws_current:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                # only walk the dict again if somebody joined or left since the last message
+                if peers_version != request.app['ws_version']:
+                    peers_version = request.app['ws_version']
+                    peers = tuple(q for q in request.app['queues'].values() if q is not out_q)
+                broadcast(peers, {'action': 'sent', 'name': name, 'text': msg.data})
+            elif msg.type == aiohttp.WSMsgType.ERROR:
+                log.error('ws connection closed with exception %s', ws_current.exception())
+    finally:
+        # unregister before anything else, even if the handler is cancelled or the loop raised,
+        # otherwise broadcasts keep filling the queue nobody drains. Already gone on shutdown.
+        request.app['websockets'].pop(name, None)
+        request.app['queues'].pop(name, None)
+        request.app['ws_version'] += 1
+
+        sender.cancel()
+        # retrieve the result, the task may have died of a broken socket already
+        await asyncio.gather(sender, return_exceptions=True)
 
-    async for msg in ws_current:
-        if msg.type == aiohttp.WSMsgType.TEXT:
-            for ws in request.app['websockets'].values():
-                if ws is not ws_current:
-                    await ws.send_json({'action': 'sent', 'name': name, 'text': msg.data})
-        elif msg.type == aiohttp.WSMsgType.ERROR:
-            log.error('ws connection closed with exception %s', ws_current.exception())
-
-    del request.app['websockets'][name]
-    log.info(f'{name} disconnected.')
-    for ws in request.app['websockets'].values():
-        await ws.send_json({'action': 'disconnect', 'name': name})
+        log.info(f'{name} disconnected.')
+        broadcast(request.app['queues'].values(), {'action': 'disconnect', 'name': name})
 
     log.info('websocket connection closed')
 
@@ -1,9 +1,11 @@
 import sys
 import asyncio
+from typing import List
 from urllib.parse import urljoin
 
 import aiohttp
 import motor.motor_asyncio
+import uvloop
 
 PROJECT = {
     'a': 'a',
@@ -16,38 +18,44 @@ JenkinsAuth = ('admin', '123456')
 
 JenkinsBaseURL = 'http://192.168.1.2:51908/job/'
 
-session = aiohttp.ClientSession(auth=aiohttp.BasicAuth(*JenkinsAuth))
+# Documents are tiny after projection, fetch them in as few round-trips as possible
+CURSOR_BATCH_SIZE = 500
 
-async def get_migrate_info(project: str, zid: int):
-    db = client.get_default_database()
-    migrate_info = []
+# Max in-flight build requests to Jenkins
+MAX_CONCURRENT_JOBS = 32
 
+
+async def get_migrate_info(db: motor.motor_asyncio.AsyncIOMotorDatabase, project: str, zid: int) -> List[dict]:
     minion_cursor = db.minion.find(
         {'cap': 0, 'status': 'enabled', 'group': {'$ne': 'other'}},
         projection={'_id': 0, 'name': 1}
-    )
-    async for name in minion_cursor:
-        gamesvr_cursor = db.gamesvr.find(
-            {'project': project, 'zid': int(zid), 'minion_name': name['name'], 'status': 'enabled'},
-            projection={'_id': 0, 'project': 1, 'zid': 1, 'sid': 1}
-        )
-        async for game in gamesvr_cursor:
-            migrate_info.append(game)
+    ).batch_size(CURSOR_BATCH_SIZE)
+    minion_names = [minion['name'] async for minion in minion_cursor]
+
+    # one query for all minions instead of one per minion
+    gamesvr_cursor = db.gamesvr.find(
+        {'project': project, 'zid': int(zid), 'minion_name': {'$in': minion_names}, 'status': 'enabled'},
+        projection={'_id': 0, 'project': 1, 'zid': 1, 'sid': 1}
+    ).batch_size(CURSOR_BATCH_SIZE)
 
-    return migrate_info
+    return [game async for game in gamesvr_cursor]
 
 
-async def build_job(**kwargs: dict):
+async def build_job(session: aiohttp.ClientSession, sem: asyncio.Semaphore, **kwargs: dict):
     """Access remote API to build the migrate job.
 
+    :param session: shared HTTP session
+    :param sem: caps the concurrent requests to Jenkins
+
     key in param `kwargs` as follow:
 
     :key project: 项目名称
     :key zid: 项目ID
     :key sid:: 游戏服ID
     """
-    async with session.post(urljoin(JenkinsBaseURL, f"{kwargs['project']}_auto_migrate_gamesvr_ops/buildWithParameters"), data=kwargs) as resp:
-        print(f"服ID: {kwargs['sid']} 的提交状态: {resp.status}")
+    async with sem:
+        async with session.post(urljoin(JenkinsBaseURL, f"{kwargs['project']}_auto_migrate_gamesvr_ops/buildWithParameters"), data=kwargs) as resp:
+            print(f"服ID: {kwargs['sid']} 的提交状态: {resp.status}")
 
 
 def get_mongodb_url(project: str) -> str:
@@ -60,26 +68,24 @@ def get_mongodb_url(project: str) -> str:
 
 
 async def main(project: str, zid: int):
+    # create the clients inside the running loop so they are bound to it
+    client = motor.motor_asyncio.AsyncIOMotorClient(get_mongodb_url(project))
     try:
-        migrate_info = await get_migrate_info(project, zid)
+        migrate_info = await get_migrate_info(client.get_default_database(), project, zid)
         if migrate_info:
-            tasks = [build_job(**info) for info in migrate_info]
-            await asyncio.gather(*tasks)
+            sem = asyncio.Semaphore(MAX_CONCURRENT_JOBS)
+            connector = aiohttp.TCPConnector(limit=2 * MAX_CONCURRENT_JOBS, limit_per_host=MAX_CONCURRENT_JOBS)
+            async with aiohttp.ClientSession(auth=aiohttp.BasicAuth(*JenkinsAuth), connector=connector) as session:
+                await asyncio.gather(*(build_job(session, sem, **info) for info in migrate_info))
         else:
             print('没有待迁移的游戏服')
     finally:
-        await session.close()
+        client.close()
 
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
-        print(f'Usage: python3.6 {__file__} project_id zone_id')
+        print(f'Usage: python3 {__file__} project_id zone_id')
         sys.exit(1)
 
-    client = motor.motor_asyncio.AsyncIOMotorClient(get_mongodb_url(sys.argv[1]))
-
-    loop = asyncio.get_event_loop()
-    try:
-        loop.run_until_complete(main(*sys.argv[1:]))
-    finally:
-        loop.close()
+    uvloop.run(main(*sys.argv[1:]))
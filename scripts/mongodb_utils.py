@@ -1,15 +1,21 @@
 #!/usr/bin/env python
 
 import os
+import asyncio
 import shutil
-import shlex
 import subprocess
 import datetime
+from typing import Iterable, List
 from urllib.parse import quote_plus
 
+from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure, OperationFailure
 
+# Look up PATH once, `None` if not installed
+MONGODUMP = shutil.which('mongodump')
+MONGORESTORE = shutil.which('mongorestore')
+
 
 class MongoDBUtil:
     def __init__(self, uri: str):
@@ -40,23 +46,28 @@ class MongoDBUtil:
         except OperationFailure:
             return False
 
+    @staticmethod
+    def _execute(args: List[str]) -> None:
+        """Run the command `args` and stream its stderr line by line.
+
+        The archive is written to file, mongodump/mongorestore only log to stderr,
+        so nothing is buffered in memory no matter how large the database is.
+        Arguments go to the program untouched, no quoting issue with special characters in the uri.
+        """
+        cmd = ' '.join(args)
+        print('cmd', cmd)
+        with subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE) as p:
+            assert p.stderr is not None
+            for line in p.stderr:
+                print(line.decode('utf-8', 'replace'), end='')
+        if p.returncode:
+            print(f'Calling command: {cmd} failed. Exit code: {p.returncode}')
+
     def backup(self):
         database = self.client.get_default_database().name
-        mongodump = shutil.which('mongodump')
+        assert MONGODUMP is not None, '找不到命令：mongodump'
         now = datetime.datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
-        cmd = f'{mongodump} --uri {self.uri} --gzip --archive=./{database}_{now}.gz'
-        print('cmd', cmd)
-        try: 
-            cp = subprocess.run(
-                shlex.split(cmd),
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding='utf-8'
-            ) 
-            print(cp.stderr) # 子进程的输出流被stderr捕获，即使设置了stdout，原因未知，其他命令正常
-        except subprocess.CalledProcessError as e: 
-            print(f'Calling command: {e.cmd} failed. Error output: {e.stderr}')
+        self._execute([MONGODUMP, '--uri', self.uri, '--gzip', f'--archive=./{database}_{now}.gz'])
 
     def restore(self, archive: str, nsFrom: str = None, nsTo: str = None):
         """
@@ -65,34 +76,72 @@ class MongoDBUtil:
         :param nsTo: 目标数据库名称
         """
         assert os.path.exists(archive), f'脚本当前目录下没有文件：{archive}'
-        mongorestore = shutil.which('mongorestore')
+        assert MONGORESTORE is not None, '找不到命令：mongorestore'
+        args = [MONGORESTORE, '--uri', self.uri, '--gzip', '--drop', f'--archive={archive}']
         if nsFrom is not None and nsTo is not None:
-            cmd = f'{mongorestore} --uri {self.uri} --gzip --drop --archive={archive} --nsFrom={nsFrom}.* --nsTo={nsTo}.*'
-        else:
-            cmd = f'{mongorestore} --uri {self.uri} --gzip --drop --archive={archive}'
-        print('cmd', cmd)
-        try: 
-            cp = subprocess.run(
-                shlex.split(cmd),
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                encoding='utf-8'
-            ) 
-            print(cp.stderr) # 子进程的输出流被stderr捕获，即使设置了stdout，原因未知，其他命令正常
-        except subprocess.CalledProcessError as e: 
-            print(f'Calling command: {e.cmd} failed. Error output: {e.stderr}')
+            args += [f'--nsFrom={nsFrom}.*', f'--nsTo={nsTo}.*']
+        self._execute(args)
+
+
+class AsyncMongoDBUtil:
+    """`MongoDBUtil` health checks on top of Motor, so that their round-trips overlap."""
+
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.client: AsyncIOMotorClient = AsyncIOMotorClient(self.uri, connect=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.client.close()
+
+    async def is_alived(self) -> bool:
+        try:
+            # The ismaster command is cheap and does not require auth.
+            await self.client.admin.command('ismaster')
+            return True
+        except (ConnectionFailure, OperationFailure):
+            return False
+
+    async def authenticated(self) -> bool:
+        try:
+            await self.client.list_database_names()
+            return True
+        except (ConnectionFailure, OperationFailure):
+            # runs alongside `is_alived`, a down server must not raise here either
+            return False
+
+    async def is_available(self) -> bool:
+        """Issue both checks concurrently"""
+        alived, authenticated = await asyncio.gather(self.is_alived(), self.authenticated())
+        return alived and authenticated
+
+
+async def check(uri: str) -> bool:
+    """
+    :param uri: MongoDB的uri
+    :returns: 能否连上MongoDB并且通过认证
+    """
+    async with AsyncMongoDBUtil(uri) as mongodbUtil:
+        return await mongodbUtil.is_available()
+
+
+async def check_many(uris: Iterable[str]) -> List[bool]:
+    """同时检查多个MongoDB，结果与`uris`的顺序一致"""
+    return await asyncio.gather(*(check(uri) for uri in uris))
 
 
 def backup(args: dict):
     """
     :param args: 命令行参数及其值
     """
+    if not asyncio.run(check(args['uri'])):
+        print('连不上MongoDB或者认证失败')
+        return
+
     with MongoDBUtil(args['uri']) as mongodbUtil:
-        if mongodbUtil.is_alived and mongodbUtil.authenticated:
-            print(mongodbUtil.backup())
-        else:
-            print('连不上MongoDB或者认证失败')
+        print(mongodbUtil.backup())
 
 
 def restore(args: dict):
@@ -101,11 +150,12 @@ def restore(args: dict):
     """
     data = dict(args)
     uri = data.pop('uri')
+    if not asyncio.run(check(uri)):
+        print('连不上MongoDB或者认证失败')
+        return
+
     with MongoDBUtil(uri) as mongodbUtil:
-        if mongodbUtil.is_alived and mongodbUtil.authenticated:
-            print(mongodbUtil.restore(**data))
-        else:
-            print('连不上MongoDB或者认证失败')
+        print(mongodbUtil.restore(**data))
 
 
 if __name__ == '__main__':
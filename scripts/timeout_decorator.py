@@ -1,10 +1,11 @@
+import multiprocessing
+import multiprocessing.util
 import os
-import sys
-import time
 import signal
-import multiprocessing
+import threading
 from functools import wraps
-from typing import Callable, NoReturn
+from multiprocessing.connection import Connection
+from typing import Callable, List, NoReturn
 
 
 class TimeoutException(Exception):
@@ -12,6 +13,12 @@ class TimeoutException(Exception):
 
 
 def timeout(number: int, use_signal: bool = True):
+    """Raise `TimeoutException` if the decorated function runs longer than `number` seconds.
+
+    With `use_signal=False` the function runs in a worker process, so the function,
+    its arguments and its result must be picklable: local or nested functions can't
+    be decorated this way, pickling them fails (e.g. `AttributeError: Can't pickle local object`).
+    """
     def wrapper(func: Callable):
         @wraps(func)
         def inner(*args, **kwargs):
@@ -28,7 +35,8 @@ def timeout(number: int, use_signal: bool = True):
                     signal.alarm(0)
                     signal.signal(signal.SIGALRM, old_handler)
             else:
-                timeout_wrapper = TimeOut(func, number)
+                # `inner` pickles by reference, the bare `func` can't
+                timeout_wrapper = TimeOut(inner, number)
                 return timeout_wrapper(*args, **kwargs)
 
         return inner
@@ -36,40 +44,126 @@ def timeout(number: int, use_signal: bool = True):
     return wrapper
 
 
-def worker(q, func, *args, **kwargs):
-    try:
-        q.put((True, func(*args, **kwargs)))
-    except:
-        q.put((False, sys.exc_info()[1]))
-    finally:
-        q.close()
+def worker(func, *args, **kwargs):
+    """Runs in a worker process. Unwrap `func` if it's decorated, or the worker would apply the timeout again."""
+    return getattr(func, '__wrapped__', func)(*args, **kwargs)
+
+
+def _serve(conn: Connection) -> None:
+    """Loop of a worker process, runs the calls received from `conn` one by one and sends back their outcome."""
+    while True:
+        try:
+            call = conn.recv()
+        except EOFError:
+            # the parent is gone
+            return
+        if call is None:
+            # no more calls
+            return
+        func, args, kwargs = call
+        try:
+            outcome = (True, worker(func, *args, **kwargs))
+        except BaseException as e:
+            outcome = (False, e)
+        try:
+            conn.send(outcome)
+        except Exception as e:
+            # result or exception not picklable
+            conn.send((False, e))
+
+
+class _Worker:
+    """A worker process and the parent end of its pipe."""
+
+    def __init__(self) -> None:
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_serve, args=(child_conn,), daemon=False)
+        self.process.start()
+        child_conn.close()
+
+    def close(self) -> None:
+        # Not just closing the pipe, workers forked later hold its parent end too and
+        # the worker would never read EOF
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+
+    def kill(self) -> None:
+        self.process.terminate()
+        self.process.join()
+        self.conn.close()
 
 
 class TimeOut:
+    """Run `func` in a worker process, worker processes are reused across calls.
+
+    Each call has a worker of its own, so it starts running at once and the timeout only
+    counts its own run. On timeout only that worker is killed.
+    """
+
+    # idle workers, at most `os.cpu_count()` of them are kept
+    _idle: List[_Worker] = []
+    _lock = threading.Lock()
+
     def __init__(self, func, number):
+        """
+        :param func: a function decorated by `timeout`, or any picklable callable
+        :param number: timeout in seconds
+        """
         self.func = func
         self.number = number
-        self.timeout = number + time.time()
-        self._queue = multiprocessing.Queue(1)
+
+    @classmethod
+    def _take(cls) -> _Worker:
+        with cls._lock:
+            while cls._idle:
+                w = cls._idle.pop()
+                if w.process.is_alive():
+                    return w
+                w.kill()
+        return _Worker()
+
+    @classmethod
+    def _give_back(cls, w: _Worker) -> None:
+        with cls._lock:
+            if len(cls._idle) < (os.cpu_count() or 1):
+                cls._idle.append(w)
+                return
+        w.close()
+
+    @classmethod
+    def _close_idle(cls) -> None:
+        with cls._lock:
+            idle, cls._idle = cls._idle, []
+        for w in idle:
+            w.close()
 
     def __call__(self, *args, **kwargs):
-        self.process = multiprocessing.Process(
-            target=worker,
-            args=(self._queue, self.func) + args,
-            kwargs=kwargs,
-            daemon=False
-        )
-        self.process.start()
+        w = self._take()
+        try:
+            w.conn.send((self.func, args, kwargs))
+        except Exception:
+            # not picklable, nothing was sent
+            self._give_back(w)
+            raise
 
-        while self.timeout > time.time():
-            if self._queue.full():
-                flag, result_or_exception_instance = self._queue.get()
-                self.process.join()
-                if flag:
-                    return result_or_exception_instance
-                raise result_or_exception_instance
-        else:    # timeout
-            self.process.terminate()
-            self.process.join()
+        if not w.conn.poll(self.number):
+            w.kill()
             raise TimeoutException(f'TimeoutException thrown out after {self.number} seconds')
 
+        try:
+            ok, result_or_exception_instance = w.conn.recv()
+        except EOFError:
+            w.kill()
+            raise RuntimeError(f'Worker process exited unexpectedly, exit code {w.process.exitcode}')
+
+        self._give_back(w)
+        if ok:
+            return result_or_exception_instance
+        raise result_or_exception_instance
+
+
+# Idle workers wait for calls forever, let them exit before multiprocessing joins its children at exit
+multiprocessing.util.Finalize(None, TimeOut._close_idle, exitpriority=10)
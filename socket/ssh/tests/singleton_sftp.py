@@ -4,13 +4,17 @@ import threading
 from .ssh_client import SSHClientV2
 
 
+# Release both threads at once, so they race on the first access of `client.sftp`
+barrier = threading.Barrier(2)
+
+
 def detect_sftp_obj(client: SSHClientV2) -> None:
     start = time.perf_counter()
     print('Start: ', time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()))
     thread_name = threading.current_thread().name
+    barrier.wait()
     sftp = client.sftp
     print(f"Thread: {thread_name}, id(sftp)={id(sftp)}")
-    time.sleep(5)
     print('End: ', time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()))
     print(f'Cost: {time.perf_counter() - start}')
 
@@ -20,10 +24,9 @@ t1 = threading.Thread(target=detect_sftp_obj, args=(client,))
 t2 = threading.Thread(target=detect_sftp_obj, args=(client,))
 try:
     t1.start()
-    # Block the main thread for prevent call `client.close`
-    t1.join()
     t2.start()
     # Block the main thread for prevent call `client.close`
+    t1.join()
     t2.join()
 finally:
     client.close()